@@ -1,38 +1,65 @@
-from typing import Tuple, List, Dict, BinaryIO, Union, cast
+from bisect import bisect_left
+from math import inf
+from mmap import mmap
+from typing import Tuple, List, Dict, Sequence, Union, cast
 
 from data_structures import LinkedList, TokenType
 from phrasal_retrieval import retrieve_phrase
-from search_helpers import load_postings_list
+from search_helpers import load_doc_ids
 
+# Galloping only pays off when one list is much longer than the other,
+# otherwise the C-level set intersection is faster.
+GALLOP_SIZE_RATIO = 64
 
-def perform_and(operand_a: LinkedList[int],
-                operand_b: LinkedList[int]) -> LinkedList:
+
+def intersect(ids_a: Sequence[int], ids_b: Sequence[int]) -> List[int]:
     """
-    Returns all ids that are ids of operand a and operand b. Copied from HW2.
+    Returns all ids that are in both of the sorted id arrays.
+
+    Arrays of similar length are intersected with python's set intersection.
+    Otherwise, both arrays are walked with index variables and the lagging
+    side gallops forward, so skewed arrays only cost O(m log(n/m))
+    comparisons.
     """
-    result = LinkedList()
-    operand_a, operand_b = operand_a.get_head(), operand_b.get_head()
-    while operand_a is not None and operand_b is not None:
-        if operand_a.value == operand_b.value:
-            result.append(operand_a.value)
-            operand_a = operand_a.next()
-            operand_b = operand_b.next()
-        elif operand_a.value < operand_b.value:
-            if operand_a.skip() and operand_a.skip().value <= operand_b.value:
-                operand_a = operand_a.skip()
-            else:
-                operand_a = operand_a.next()
-        elif operand_b.skip() and operand_b.skip().value <= operand_a.value:
-            operand_b = operand_b.skip()
+    length_a, length_b = len(ids_a), len(ids_b)
+    if min(length_a, length_b) * GALLOP_SIZE_RATIO > max(length_a, length_b):
+        return sorted(set(ids_a).intersection(ids_b))
+    result = []
+    i = j = 0
+    while i < length_a and j < length_b:
+        id_a, id_b = ids_a[i], ids_b[j]
+        if id_a == id_b:
+            result.append(id_a)
+            i += 1
+            j += 1
+        elif id_a < id_b:
+            i = gallop(ids_a, id_b, i + 1)
         else:
-            operand_b = operand_b.next()
+            j = gallop(ids_b, id_a, j + 1)
     return result
 
 
+def gallop(ids: Sequence[int], target: int, low: int) -> int:
+    """
+    Returns the first index from low onwards whose id is not less than target.
+
+    The stride is doubled until it overshoots target, then the bracketed
+    range is bisected.
+    """
+    length = len(ids)
+    high = low
+    step = 1
+    while high < length and ids[high] < target:
+        low = high + 1
+        high += step
+        step *= 2
+    return bisect_left(ids, target, low, min(high, length))
+
+
 def perform_boolean_query(
-        tokens: List[Tuple[str, Union[List[str], str]]],
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        postings_file: BinaryIO) -> LinkedList:
+        tokens: List[Tuple[TokenType, Union[List[str], str]]],
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        postings_file: mmap) -> LinkedList:
     """
     Returns a LinkedList of documents that satisfy a purely conjunctive boolean
     query.
@@ -41,61 +68,82 @@ def perform_boolean_query(
         (<'phrase' | 'nonphrase', <term>) where <term> is a query term/phrase
         -- phrases are Lists, single terms are strings.
     :param dictionary the combined TF-IDF and positional index dictionary
-    :param postings_file the read-only binary file descriptor for the postings
-        list file.
+    :param postings_file the read-only memory map of the postings list file.
     :return: A LinkedList of document IDs that satisfy the boolean query.
     """
 
-    def get_idf(token: Tuple[str, Union[List[str], str]]) -> float:
+    # IDF of every term in the query (first item in the dictionary tuple),
+    # looked up once instead of on every call of the sort key below.
+    idfs = {}
+    for term_type, phrase in tokens:
+        for term in (phrase if term_type is TokenType.PHRASE else [phrase]):
+            entry = dictionary.get(term)
+            if entry is not None:
+                idfs[term] = entry[0]
+
+    def get_postings_length_rank(
+            token: Tuple[TokenType, Union[List[str], str]]) -> float:
         """
-        Helper function to get the IDF of a phrase/term.
+        Helper function to rank a phrase/term by the length of its postings
+        list, shortest first.
 
-        The IDF of a phrase is estimated by summing up the IDF of the
-        individual terms. This works out as phrases usually produce small
-        resultant postings lists, and a phrase with rare terms (high IDF) will
-        produce smaller postings lists than a phrase with common terms.
+        The IDF strictly decreases with the document frequency, so ranking
+        terms by descending IDF orders them by their exact postings length.
+        A phrase cannot occur in more documents than its rarest term, so it is
+        ranked by its rarest term. Terms not in the dictionary have empty
+        postings lists and are ranked first.
         """
         term_type, phrase = token
-        if term_type == TokenType.PHRASE:
-            phrase = cast(List[str], phrase)
-            # Returns the sum of the idfs of each term
-            # (first item in the dictionary tuple)
-            return sum(
-                map(
-                    lambda term: dictionary[term][0]
-                    if term in dictionary else 0, phrase))
-        elif term_type == TokenType.NON_PHRASE:
-            term = cast(str, phrase)
-            return dictionary[term][0] if term in dictionary else 0
+        terms = phrase if term_type is TokenType.PHRASE else [phrase]
+        if any(term not in idfs for term in terms):
+            return -inf
+        return -max((idfs[term] for term in terms), default=0)
 
-    def get_postings_list(term_type: str,
-                          phrase: Union[List[str], str]) -> LinkedList:
+    def get_doc_ids(term_type: TokenType,
+                    phrase: Union[List[str], str]) -> Sequence[int]:
         """
-        Helper function to get a postings list length of a phrase/term.
-        Returns empty LinkedList if phrase does not exist.
+        Helper function to get the sorted document ids of a phrase/term.
+        Returns an empty sequence if phrase does not exist or is of an
+        unknown type.
         """
-        if term_type == TokenType.PHRASE:
-            return retrieve_phrase(dictionary, postings_file, phrase)
-        elif term_type == TokenType.NON_PHRASE:
+        if term_type is TokenType.PHRASE:
+            postings = retrieve_phrase(dictionary, postings_file, phrase)
+            return [doc_id for doc_id, _ in postings]
+        elif term_type is TokenType.NON_PHRASE:
             term = cast(str, phrase)
-            return load_postings_list(postings_file, dictionary, term)
+            return load_doc_ids(postings_file, dictionary, term)
+        return []
 
     # Guard against empty tokens list
     if not tokens:
         return LinkedList()
 
-    # Optimization for faster AND computation -- do the rarer term.
-    list.sort(tokens, key=get_idf, reverse=True)
+    # A repeated term or phrase does not change the conjunction, so each one
+    # is only loaded and intersected once.
+    unique_tokens = {}
+    for term_type, phrase in tokens:
+        key = tuple(phrase) if term_type is TokenType.PHRASE else phrase
+        unique_tokens.setdefault((term_type, key), (term_type, phrase))
+    tokens = list(unique_tokens.values())
+
+    # Optimization for faster AND computation -- do the shortest list first.
+    list.sort(tokens, key=get_postings_length_rank)
+
+    # Short circuit if a phrase/term is not in the dictionary, as the result
+    # is then empty -- no postings list needs to be read at all.
+    if get_postings_length_rank(tokens[0]) == -inf:
+        return LinkedList()
 
-    # Generate a list of Postings lists
-    resultant_list: LinkedList[int] = get_postings_list(*tokens[0])
+    # The running intersection is kept as a plain sequence of ids, so no
+    # intermediate LinkedList is built between the steps.
+    resultant_ids = get_doc_ids(*tokens[0])
 
-    # Successively use AND on the tokens' postings lists
+    # Successively intersect with the tokens' document ids
     for token in tokens[1:]:
-        # Short circuit for empty LinkedList --
+        # Short circuit for empty intersection --
         # cannot be done easily when using `reduce`
-        if not resultant_list:
+        if not resultant_ids:
             break
-        resultant_list = perform_and(resultant_list, get_postings_list(*token))
+        resultant_ids = intersect(resultant_ids, get_doc_ids(*token))
 
-    return resultant_list
+    return LinkedList.from_list(resultant_ids)
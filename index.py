@@ -4,22 +4,29 @@ Creates an index for our SearchEngine
 
 from collections import defaultdict, Counter
 import pickle
+from array import array
 import getopt
-from math import sqrt, log
-from functools import lru_cache
+import io
+from math import hypot, log10
+from operator import itemgetter
 import sys
 import csv
 import time
 import gc
 import os
 
-from typing import Dict, List, Tuple, Any, BinaryIO
+from typing import Dict, Iterable, List, Tuple, Any, BinaryIO
 
-import nltk
-from nltk.stem.porter import PorterStemmer
 from joblib import Parallel, delayed
 
-from data_structures import LinkedList
+from postings_codec import (encode_positional_postings, encode_postings,
+                            new_postings)
+from search_helpers import (STEM_CACHE, STEM_CACHE_SUFFIX, TOKEN_PATTERN,
+                            normalise_tokens, get_weighted_tf,
+                            load_stem_cache, save_stem_cache, take_new_stems)
+
+# Number of documents sent to a worker process at once
+PARALLEL_BATCH_SIZE = 256
 
 
 def usage() -> None:
@@ -69,166 +76,179 @@ def usage() -> None:
 #     return biword_tokens.union(triword_tokens)
 
 
-def build_document_vectors(
-        data: List[Tuple[str, List[str]]]) -> Dict[str, Dict[str, int]]:
-    """
-    Builds a document vector out of the rows in the data.
-    The dictionary maps a token to its document vector, where document vector
-    is a counter, mapping doc_id to occurrence.
-    """
-    return {doc_id: Counter(content) for doc_id, content in data}
-
-
-def build_positional_index(
-        data: List[Tuple[str, List[str]]]
-) -> Dict[str, LinkedList[Tuple[str, LinkedList[int]]]]:
+def build_indexes(
+    data: List[Tuple[int, Dict[str, List[int]], Dict[str, int], float]]
+) -> Tuple[Dict[str, Tuple[array, array]],
+           Dict[str, List[Tuple[int, List[int]]]],
+           Dict[int, Dict[str, int]], Dict[int, float], int]:
     """
-    Builds a positional index out of the rows in the data.
+    Builds the tf-idf index, the positional index and the document vectors
+    out of the indexed documents in the data, sorted by doc_id, in a single
+    pass over the documents.
+    The tf-idf index stores the document ids and term frequencies of each
+    token in two arrays. Term frequencies are weighted when the postings are
+    loaded. The document vectors map a doc_id to a counter,
+    mapping token to occurrence.
     """
-    index: Dict[str, LinkedList[Tuple[str, LinkedList[int]]]] = defaultdict(
-        LinkedList)
-    for doc_id, content in data:
-        positions_index: Dict[str, LinkedList[int]] = defaultdict(LinkedList)
-        for i, token in enumerate(content):
-            positions_index[token].append(i)
+    index: Dict[str, Tuple[array, array]] = defaultdict(new_postings)
+    positional_index: Dict[str, List[Tuple[int, List[int]]]] = defaultdict(
+        list)
+    document_vectors: Dict[int, Dict[str, int]] = {}
+    doc_vector_lengths: Dict[int, float] = {}
+    for doc_id, positions_index, token_count, vector_length in data:
         for token, positions in positions_index.items():
-            index[token].append((doc_id, positions))
-    return index
-
+            doc_ids, term_frequencies = index[token]
+            doc_ids.append(doc_id)
+            term_frequencies.append(token_count[token])
+            positional_index[token].append((doc_id, positions))
+        document_vectors[doc_id] = token_count
+        doc_vector_lengths[doc_id] = vector_length
 
-def build_tfidf_index(
-        data: List[Tuple[str, List[str]]]
-) -> Tuple[Dict[str, LinkedList[Tuple[str, float]]], Dict[str, float], int]:
-    """
-    Builds both a tf-idf index from the data.
-    """
-    index: Dict[str, LinkedList[Tuple[str, float]]] = defaultdict(LinkedList)
-    all_docs_length = len(data)
-    all_token_count = [get_token_weights(content) for _, content in data]
-    doc_vector_lengths = {
-        doc_id: get_document_vector_length(token_count)
-        for (doc_id, _), token_count in zip(data, all_token_count)
-    }
-    for (doc_id, _), token_count in zip(data, all_token_count):
-        for token, count in token_count.items():
-            index[token].append((doc_id, count))
+    return (index, positional_index, document_vectors, doc_vector_lengths,
+            len(data))
 
-    return index, doc_vector_lengths, all_docs_length
 
-
-def get_token_weights(content: List[str]) -> Dict[str, float]:
+def index_document(
+    content: List[str]
+) -> Tuple[Dict[str, List[int]], Dict[str, int], float]:
     """
-    Tokenise the text contained in the given filename.
+    Indexes a single document, returning the positions each token occurs at,
+    the token counts and the length of the document vector.
     """
-    token_count = Counter(content)
-    return {k: get_weighted_tf(v) for k, v in token_count.items()}
-
-
-def get_document_vector_length(token_count: Dict[str, float]) -> float:
+    positions_index: Dict[str, List[int]] = defaultdict(list)
+    for i, token in enumerate(content):
+        positions_index[token].append(i)
+    token_count = Counter(
+        {token: len(positions)
+         for token, positions in positions_index.items()})
+    return (dict(positions_index), token_count,
+            get_document_vector_length(
+                map(get_weighted_tf, token_count.values())))
+
+
+def get_document_vector_length(weights: Iterable[float]) -> float:
     """
     Calculates the vector normalisation factor
     using the 'cosine normalization' scheme.
+    Only the weights are needed, so they are not kept in a dict by token.
     """
-    return sqrt(sum(val**2 for val in token_count.values()))
+    return hypot(*weights)
 
 
-def read_data_file(input_file: str) -> List[Tuple[str, List[str]]]:
+def read_data_file(
+    input_file: str, stem_cache_location: str
+) -> List[Tuple[int, Dict[str, List[int]], Dict[str, int], float]]:
     """
-    Return a list of data sorted by the file name
+    Return a list of the indexed documents in the data file.
+    Each worker is sent the raw row and returns its document already
+    tokenised, normalised and indexed, so that the tokens are never sent
+    between processes.
     """
     csv.field_size_limit(sys.maxsize)
+    # Loaded before the workers are forked, so that they share the stems
+    # saved by the previous run instead of each reading the file again.
+    STEM_CACHE.update(load_stem_cache(stem_cache_location))
     with open(input_file) as csv_file:
         reader = csv.reader(csv_file, delimiter=",")
-        return Parallel(
-            n_jobs=-1, verbose=10, backend="multiprocessing")(
+        # Skip the header row
+        next(reader, None)
+        # This is the only worker pool of the build. It uses the
+        # multiprocessing backend, as forked workers inherit STEM_CACHE,
+        # whereas loky workers would start with an empty one.
+        rows = Parallel(
+            n_jobs=-1, verbose=10, backend="multiprocessing",
+            batch_size=PARALLEL_BATCH_SIZE)(
                 delayed(parse_row)(row) for row in reader)
+    data = []
+    for doc_id, positions_index, token_count, vector_length, new_stems in rows:
+        STEM_CACHE.update(new_stems)
+        data.append((doc_id, positions_index, token_count, vector_length))
+    return data
 
 
-def parse_row(row: List[str]) -> Tuple[str, List[str]]:
-    """
-    Parses the content by tokenising the content and normalising each word
-    """
-    return (row[0], [normalise(word) for word in nltk.word_tokenize(row[2])])
-
-
-@lru_cache(maxsize=None)
-def normalise(word: str) -> str:
+def parse_row(
+    row: List[str]
+) -> Tuple[int, Dict[str, List[int]], Dict[str, int], float, Dict[str, str]]:
     """
-    Normalises the word using stemmer from NLTK.
+    Parses the content by tokenising the content and normalising each word,
+    then indexes it with index_document.
+    The stems first computed while parsing the row are returned with it.
     """
-    word = word.lower()
-    return PorterStemmer().stem(word)
+    content = normalise_tokens(TOKEN_PATTERN.findall(row[2].lower()))
+    return (int(row[0]), *index_document(content), take_new_stems())
 
 
-def get_idf(all_docs_length: int, val: int) -> float:
+def get_idf(all_docs_length_log: float, val: int) -> float:
     """
     Calculates the inverse document frequency using
-    the 'inverse collection frequency' scheme.
+    the 'inverse collection frequency' scheme, given the log10 of the number
+    of documents.
     """
-    return log((float(all_docs_length) / val), 10)
-
-
-def get_weighted_tf(count: int, base: int = 10) -> float:
-    """
-    Calculates the weighted term frequency using the
-    'logarithm' scheme.
-    """
-    return log(base * count, base)
+    return all_docs_length_log - log10(val)
 
 
 def store_to_postings_file(
-        index: Dict[str, LinkedList[Tuple[str, float]]],
-        positional_index: Dict[str, LinkedList[Tuple[str, LinkedList[int]]]],
-        document_vectors: Dict[str, Dict[str, int]], output_file_postings: str,
+        index: Dict[str, Tuple[array, array]],
+        positional_index: Dict[str, List[Tuple[int, List[int]]]],
+        document_vectors: Dict[int, Dict[str, int]], output_file_postings: str,
         num_documents: int
-) -> Tuple[Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-           Dict[str, Tuple[int, int]]]:
+) -> Tuple[Dict[str, Tuple[float, int, int, int, int]],
+           Dict[int, Tuple[int, int]]]:
     """
     Stores the postings in index and the positional index in positional_index
     to postings file and generate a dictionary to access the postings file.
     """
+    # The postings are gathered in memory and written out at once, so that
+    # taking the offset of every entry does not cost a seek on the file.
+    postings_buffer = io.BytesIO()
+    dictionary = store_postings_positional_to_postings_file(
+        index, positional_index, num_documents, postings_buffer)
+    document_vectors_dictionary = store_document_vectors_to_postings_file(
+        document_vectors, postings_buffer)
     with open(output_file_postings, "wb") as postings_file:
-        dictionary = store_postings_positional_to_postings_file(
-            index, positional_index, num_documents, postings_file)
-        document_vectors_dictionary = store_document_vectors_to_postings_file(
-            document_vectors, postings_file)
+        postings_file.write(postings_buffer.getbuffer())
 
-        return dictionary, document_vectors_dictionary
+    return dictionary, document_vectors_dictionary
 
 
 def store_postings_positional_to_postings_file(
-        index: Dict[str, LinkedList[Tuple[str, float]]],
-        positional_index: Dict[str, LinkedList[Tuple[str, LinkedList[int]]]],
+        index: Dict[str, Tuple[array, array]],
+        positional_index: Dict[str, List[Tuple[int, List[int]]]],
         num_documents: int, postings_file: BinaryIO
-) -> Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]]:
+) -> Dict[str, Tuple[float, int, int, int, int]]:
     dictionary = {}
-    tokens = set(index).union(set(positional_index))
-    for token in tokens:
-        postings = index[token]
-        postings_offset, postings_length = pickle_to_file(
-            postings_file, postings)
-        positional_offset, positional_length = pickle_to_file(
-            postings_file, positional_index[token])
-        dictionary[token] = (get_idf(num_documents, len(postings)),
-                             (postings_offset, postings_length),
-                             (positional_offset, positional_length))
+    num_documents_log = log10(num_documents)
+    # Sorted, so that postings of lexically close tokens are close in the file
+    for token in sorted(index.keys() | positional_index.keys()):
+        doc_ids, term_frequencies = index[token]
+        postings_offset, postings_length = write_to_file(
+            postings_file, encode_postings(doc_ids, term_frequencies))
+        positional_offset, positional_length = write_to_file(
+            postings_file,
+            encode_positional_postings(positional_index[token]))
+        # The entry is kept flat, as nested location tuples would make the
+        # dictionary file larger and slower to load at every search.
+        dictionary[token] = (get_idf(num_documents_log, len(doc_ids)),
+                             postings_offset, postings_length,
+                             positional_offset, positional_length)
     return dictionary
 
 
 def store_document_vectors_to_postings_file(
-        document_vectors: Dict[str, Dict[str, int]],
-        postings_file: BinaryIO) -> Dict[str, Tuple[int, int]]:
+        document_vectors: Dict[int, Dict[str, int]],
+        postings_file: BinaryIO) -> Dict[int, Tuple[int, int]]:
     document_vectors_dictionary = {}
+    pickler = pickle.Pickler(postings_file, pickle.HIGHEST_PROTOCOL)
     for key, value in document_vectors.items():
-        offset, length = pickle_to_file(postings_file, value)
+        offset, length = pickle_to_file(postings_file, pickler, value)
         document_vectors_dictionary[key] = (offset, length)
     return document_vectors_dictionary
 
 
 def store_to_dictionary_file(
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        document_vectors_dictionary: Dict[str, Tuple[int, int]],
-        vector_lengths: Dict[str, float], output_file_dictionary: str) -> None:
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        document_vectors_dictionary: Dict[int, Tuple[int, int]],
+        vector_lengths: Dict[int, float], output_file_dictionary: str) -> None:
     """
     Stores a tuple of dictionary and vector_lengths to the dictionary file.
     """
@@ -237,15 +257,28 @@ def store_to_dictionary_file(
                     dictionary_file, pickle.HIGHEST_PROTOCOL)
 
 
-def pickle_to_file(postings_file: BinaryIO, something: Any) -> Tuple[int, int]:
+def pickle_to_file(postings_file: BinaryIO, pickler: pickle.Pickler,
+                   something: Any) -> Tuple[int, int]:
     """
-    Stores the given object to a file object postings_file
+    Stores the given object to a file object postings_file with the pickler
+    writing to it, and returns the offset and length it is written at.
     """
     offset = postings_file.tell()
-    pickled = pickle.dumps(something, pickle.HIGHEST_PROTOCOL)
-    length = len(pickled)
-    postings_file.write(pickled)
-    return offset, length
+    pickler.dump(something)
+    # Each object is loaded on its own, so it must not refer to objects
+    # memoised while pickling the previous ones.
+    pickler.clear_memo()
+    return offset, postings_file.tell() - offset
+
+
+def write_to_file(postings_file: BinaryIO, data: bytes) -> Tuple[int, int]:
+    """
+    Writes the given bytes to a file object postings_file and returns the
+    offset and length they are written at.
+    """
+    offset = postings_file.tell()
+    postings_file.write(data)
+    return offset, len(data)
 
 
 def main() -> None:
@@ -278,22 +311,25 @@ def main() -> None:
     print("Building index")
 
     print("1. Retrieving data")
-    data = read_data_file(input_file)
+    stem_cache_location = output_file_dictionary + STEM_CACHE_SUFFIX
+    data = read_data_file(input_file, stem_cache_location)
+    save_stem_cache(stem_cache_location)
     print("Time taken = " + str(time.time() - cur_time))
 
     print("2. Sorting data")
     cur_time = time.time()
-    data = sorted(data)
-    print("Time taken = " + str(time.time() - cur_time))
-
-    print("3. Building tf-idf index")
-    cur_time = time.time()
-    index, vector_lengths, num_documents = build_tfidf_index(data)
+    # Sort in place by doc_id only, so that the indexed documents are never
+    # compared. Rows mostly arrive in order, which Timsort handles in a
+    # single run.
+    data.sort(key=itemgetter(0))
     print("Time taken = " + str(time.time() - cur_time))
 
-    print("3b. Building document vectors")
+    print("3. Building tf-idf index, document vectors and positional index")
     cur_time = time.time()
-    document_vectors = build_document_vectors(data)
+    (index, positional_index, document_vectors, vector_lengths,
+     num_documents) = build_indexes(data)
+    # The list of documents is not needed anymore, free it before storing
+    del data
     print("Time taken = " + str(time.time() - cur_time))
 
     # print("4. Building Biword Triword index")
@@ -301,19 +337,14 @@ def main() -> None:
     # bitriword_index = build_bitriword_index(data)
     # print("Time taken = " + str(time.time() - cur_time))
 
-    print("4. Building positional index")
-    cur_time = time.time()
-    positional_index = build_positional_index(data)
-    print("Time taken = " + str(time.time() - cur_time))
-
-    print("5. Storing to postings file")
+    print("4. Storing to postings file")
     cur_time = time.time()
     dictionary, document_vectors_dictionary = store_to_postings_file(
         index, positional_index, document_vectors, output_file_postings,
         num_documents)
     print("Time taken = " + str(time.time() - cur_time))
 
-    print("6. Storing to dictionary file")
+    print("5. Storing to dictionary file")
     cur_time = time.time()
     store_to_dictionary_file(dictionary, document_vectors_dictionary,
                              vector_lengths, output_file_dictionary)
@@ -1,26 +1,36 @@
-from typing import Dict, Tuple, List, BinaryIO, cast
-from data_structures import LinkedList, Node
-from search_helpers import load_positional_index
+from mmap import mmap
+from functools import partial
+from operator import add
+from typing import Dict, Tuple, List
+from search_helpers import load_positional_index, prefetch_postings
 
 
 def retrieve_phrase(
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        postings_file: BinaryIO,
-        tokens: List[str]) -> LinkedList[Tuple[str, LinkedList[int]]]:
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        postings_file: mmap,
+        tokens: List[str]) -> List[Tuple[int, List[int]]]:
     """
-    Returns a LinkedList of documents that contain a specific phrase.
+    Returns a list of documents that contain a specific phrase.
 
     :param dictionary
-    :param postings_file the read-only binary file descriptor
+    :param postings_file the read-only memory map of the postings file
     :param tokens tokens in phrase
-    :return: A LinkedList of document IDs ().
+    :return: A list of (doc_id, positions) of the last token of the phrase.
     """
     if not tokens:
-        return LinkedList()
+        return []
 
+    # The positional postings of the whole phrase are read ahead together,
+    # in file order, rather than faulted in one term at a time.
+    prefetch_postings(postings_file, (dictionary[token][3:]
+                                      for token in tokens
+                                      if token in dictionary))
     positional_index = load_positional_index(postings_file, dictionary,
                                              tokens[0])
     for token in tokens[1:]:
+        # Short circuit as the phrase cannot occur in any document
+        if not positional_index:
+            break
         next_positional_index = load_positional_index(postings_file,
                                                       dictionary, token)
         positional_index = merge_positional_indexes(positional_index,
@@ -29,52 +39,25 @@ def retrieve_phrase(
     return positional_index
 
 
-def merge_positional_indexes(before: LinkedList[Tuple[str, LinkedList[int]]],
-                             after: LinkedList[Tuple[str, LinkedList[int]]]
-                             ) -> LinkedList[Tuple[str, LinkedList[int]]]:
-    result = LinkedList()
-    before, after = before.get_head(), after.get_head()
-    while before is not None and after is not None:
-        before_id, before_positions = before.value
-        after_id, after_positions = after.value
-        if before_id == after_id:
-            merge_result = merge_positions(before_positions, after_positions)
-            if merge_result:
-                result.append((before_id, merge_result))
-            before = before.next()
-            after = after.next()
-        elif before_id < after_id:
-
-            if before.skip() and before.skip().value[0] <= after_id:
-                before = before.skip()
-            else:
-                before = before.next()
-        elif after.skip() and after.skip().value[0] <= before_id:
-            after = after.skip()
-        else:
-            after = after.next()
+def merge_positional_indexes(before: List[Tuple[int, List[int]]],
+                             after: List[Tuple[int, List[int]]]
+                             ) -> List[Tuple[int, List[int]]]:
+    result = []
+    before_positions, after_positions = dict(before), dict(after)
+    # The common documents are found with a set intersection in C, only
+    # their positions are merged in Python.
+    for doc_id in sorted(before_positions.keys() & after_positions.keys()):
+        merge_result = merge_positions(before_positions[doc_id],
+                                       after_positions[doc_id])
+        if merge_result:
+            result.append((doc_id, merge_result))
     return result
 
 
-def merge_positions(before_positions: LinkedList[int],
-                    after_positions: LinkedList[int]):
-    result = LinkedList()
-    before, after = before_positions.get_head(), after_positions.get_head()
-
-    while before is not None and after is not None:
-        before, after = cast(Node[int], before), cast(Node[int],
-                                                      after)  # typecasting
-        if before.value == after.value - 1:
-            result.append(after.value)
-            before = before.next()
-            after = after.next()
-        elif before.value < after.value - 1:
-            if before.skip() and before.skip().value <= after.value - 1:
-                before = before.skip()
-            else:
-                before = before.next()
-        elif after.skip() and after.skip().value - 1 <= before.value:
-            after = after.skip()
-        else:
-            after = after.next()
-    return result
+def merge_positions(before_positions: List[int],
+                    after_positions: List[int]) -> List[int]:
+    # A position in after continues the phrase if the position before it is
+    # in before.
+    return sorted(
+        set(after_positions).intersection(
+            map(partial(add, 1), before_positions)))
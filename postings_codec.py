@@ -0,0 +1,179 @@
+"""
+Encodes and decodes the postings lists and positional postings lists stored
+in the postings file.
+
+A postings list is stored as a header holding the number of postings and
+which of DELTA_TYPECODES the term frequencies are stored with, the array of
+term frequencies, then the document ids. The first document id is stored
+whole, the others are delta encoded in blocks of BLOCK_SIZE, each block
+prefixed with a byte telling which of DELTA_TYPECODES its deltas are stored
+with, so that small gaps take a single byte even when the ids are large.
+Everything is in native byte order.
+"""
+from array import array
+from itertools import accumulate, chain
+from struct import Struct
+from typing import Iterable, List, Sequence, Tuple
+
+DOC_ID_TYPECODE = 'i'
+TERM_FREQUENCY_TYPECODE = 'I'
+HEADER = Struct('IB')
+POSITIONAL_HEADER = Struct('II')
+FIRST_DOC_ID = Struct(DOC_ID_TYPECODE)
+POSITION_COUNT_TYPECODE = 'I'
+BLOCK_SIZE = 128
+# From the narrowest to the widest, a block uses the first one that fits
+DELTA_TYPECODES = ('B', 'H', 'I')
+
+
+def new_postings() -> Tuple[array, array]:
+    """
+    Returns the empty document ids and term frequencies arrays of a postings
+    list being built.
+    """
+    return array(DOC_ID_TYPECODE), array(TERM_FREQUENCY_TYPECODE)
+
+
+def encode_postings(doc_ids: Sequence[int],
+                    term_frequencies: Sequence[int]) -> bytes:
+    """
+    Encodes a postings list, given as its document ids in increasing order
+    and their term frequencies, into bytes.
+    """
+    code = get_narrowest_code(max(term_frequencies, default=0))
+    return (HEADER.pack(len(doc_ids), code) +
+            array(DELTA_TYPECODES[code], term_frequencies).tobytes() +
+            encode_doc_ids(doc_ids))
+
+
+def get_narrowest_code(largest: int) -> int:
+    """
+    Returns the index of the narrowest of DELTA_TYPECODES that holds largest.
+    """
+    for code, typecode in enumerate(DELTA_TYPECODES):
+        if largest < 1 << (8 * array(typecode).itemsize):
+            return code
+    raise OverflowError(f"{largest} does not fit in {DELTA_TYPECODES}")
+
+
+def encode_doc_ids(doc_ids: Sequence[int]) -> bytes:
+    """
+    Encodes the first of the sorted document ids whole, and delta encodes
+    the others from it block by block.
+    """
+    if not doc_ids:
+        return b''
+    return FIRST_DOC_ID.pack(doc_ids[0]) + encode_deltas(
+        [doc_id - previous for previous, doc_id in zip(doc_ids, doc_ids[1:])])
+
+
+def encode_deltas(deltas: List[int]) -> bytes:
+    """
+    Encodes the non-negative deltas block by block, each block with the
+    narrowest of DELTA_TYPECODES that fits its largest delta.
+    """
+    encoded = bytearray()
+    for start in range(0, len(deltas), BLOCK_SIZE):
+        block = deltas[start:start + BLOCK_SIZE]
+        code = get_narrowest_code(max(block))
+        encoded.append(code)
+        encoded += array(DELTA_TYPECODES[code], block).tobytes()
+    return bytes(encoded)
+
+
+def encode_positional_postings(
+        postings: Iterable[Tuple[int, Iterable[int]]]) -> bytes:
+    """
+    Encodes a positional postings list of (doc_id, positions), sorted by
+    doc_id and then by position, into bytes.
+
+    The header holds the number of postings and the size of the encoded
+    document ids. It is followed by the number of positions in each
+    posting, the document ids, then the positions of every posting, each
+    delta encoded from the start of its document.
+    """
+    doc_ids = []
+    position_counts = array(POSITION_COUNT_TYPECODE)
+    deltas: List[int] = []
+    for doc_id, positions in postings:
+        doc_ids.append(doc_id)
+        positions = list(positions)
+        position_counts.append(len(positions))
+        deltas.extend(
+            position - previous
+            for previous, position in zip(chain((0,), positions), positions))
+    encoded_doc_ids = encode_doc_ids(doc_ids)
+    return (POSITIONAL_HEADER.pack(len(doc_ids), len(encoded_doc_ids)) +
+            position_counts.tobytes() + encoded_doc_ids +
+            encode_deltas(deltas))
+
+
+def get_doc_ids_offset(header: bytes) -> int:
+    """
+    Returns where the document ids start in an encoded postings list, given
+    its header.
+    """
+    count, code = HEADER.unpack_from(header)
+    return HEADER.size + count * array(DELTA_TYPECODES[code]).itemsize
+
+
+def decode_doc_ids(encoded: bytes) -> array:
+    """
+    Decodes the document ids section of an encoded postings list,
+    which starts at `get_doc_ids_offset`.
+    """
+    if not encoded:
+        return array(DOC_ID_TYPECODE)
+    first_doc_id, = FIRST_DOC_ID.unpack_from(encoded)
+    return array(
+        DOC_ID_TYPECODE,
+        accumulate(decode_deltas(encoded[FIRST_DOC_ID.size:]),
+                   initial=first_doc_id))
+
+
+def decode_deltas(encoded: bytes) -> List[int]:
+    """
+    Decodes deltas encoded by `encode_deltas`.
+    """
+    deltas: List[int] = []
+    position = 0
+    while position < len(encoded):
+        packed = array(DELTA_TYPECODES[encoded[position]])
+        end = position + 1 + packed.itemsize * BLOCK_SIZE
+        packed.frombytes(encoded[position + 1:end])
+        deltas.extend(packed)
+        position = end
+    return deltas
+
+
+def decode_term_frequencies(encoded: bytes) -> array:
+    """
+    Decodes the term frequencies of an encoded postings list, of which only
+    the part before `get_doc_ids_offset` is needed.
+    """
+    _, code = HEADER.unpack_from(encoded)
+    term_frequencies = array(DELTA_TYPECODES[code])
+    term_frequencies.frombytes(
+        encoded[HEADER.size:get_doc_ids_offset(encoded)])
+    return term_frequencies
+
+
+def decode_positional_postings(
+        encoded: bytes) -> List[Tuple[int, List[int]]]:
+    """
+    Decodes an encoded positional postings list into its (doc_id, positions).
+    """
+    count, doc_ids_size = POSITIONAL_HEADER.unpack_from(encoded)
+    position_counts = array(POSITION_COUNT_TYPECODE)
+    start = POSITIONAL_HEADER.size
+    end = start + count * position_counts.itemsize
+    position_counts.frombytes(encoded[start:end])
+    doc_ids = decode_doc_ids(encoded[end:end + doc_ids_size])
+    deltas = decode_deltas(encoded[end + doc_ids_size:])
+    postings = []
+    start = 0
+    for doc_id, position_count in zip(doc_ids, position_counts):
+        end = start + position_count
+        postings.append((doc_id, list(accumulate(deltas[start:end]))))
+        start = end
+    return postings
@@ -1,9 +1,10 @@
-from typing import Tuple, List, Dict, BinaryIO
+from mmap import mmap
+from typing import Tuple, List, Dict
 from collections import Counter, defaultdict
 from nltk.corpus import wordnet
 
-from data_structures import LinkedList
-from search_helpers import normalise, load_postings_list, load_document_vector
+from search_helpers import (normalise, load_weighted_postings,
+                            load_document_vector, prefetch_postings)
 
 # Variables for tuning
 ALPHA = 1.0
@@ -14,62 +15,66 @@ RELEVANT_FEEDBACK = True
 
 
 def get_relevant_docs(
-        query: str,
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        vector_lengths: Dict[str, float], relevant_doc_ids: List[str],
-        document_vectors_dictionary: Dict[str, Tuple[int, int]],
-        postings_file: BinaryIO) -> LinkedList:
-    query_vector = query_to_vector(query)
-    if QUERY_EXPANSION:  # Requires non-normalized terms
+        query_vector: Dict[str, int],
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        vector_lengths: Dict[int, float], relevant_doc_ids: List[int],
+        document_vectors_dictionary: Dict[int, Tuple[int, int]],
+        postings_file: mmap) -> List[int]:
+    # The query terms are already normalised by the query parser, and the
+    # expanded terms by query_expansion. Normalising them again would not
+    # be a no-op, as stemming a stem can shorten it further.
+    if QUERY_EXPANSION:
         query_vector = query_expansion(query_vector)
-    query_vector = normalized_vector(query_vector)
     if RELEVANT_FEEDBACK:  # Requires normalized terms
         query_vector = rocchio_algorithm(query_vector, relevant_doc_ids,
                                          document_vectors_dictionary, ALPHA, BETA,
                                          postings_file)
+    prefetch_postings(postings_file,
+                      (dictionary[term][1:3] for term in query_vector
+                       if term in dictionary))
     scores = defaultdict(float)
     for term, factor in query_vector.items():
-        if term not in dictionary:
+        entry = dictionary.get(term)
+        if entry is None:
             continue
-        term_postings = load_postings_list(postings_file, dictionary, term)
-        idf = dictionary[term][0]
-        for doc_id, tf_d in term_postings:
-            scores[doc_id] += factor * tf_d * idf
-    normalized_scores = sorted(((doc_id, score / vector_lengths[doc_id])
-                                for doc_id, score in scores.items()),
-                               key=lambda x: x[1],
-                               reverse=True)
-    relevant_docs = (x[0] for x in normalized_scores if x[1] > THRESHOLD)
-    output = LinkedList()
-    output.extend(relevant_docs)
-    return output
+        doc_ids, weights = load_weighted_postings(postings_file, dictionary,
+                                                  term)
+        # The query side of the product is the same for every posting
+        term_weight = factor * entry[0]
+        for doc_id, tf_d in zip(doc_ids, weights):
+            scores[doc_id] += term_weight * tf_d
+    normalized_scores = {
+        doc_id: score / vector_lengths[doc_id]
+        for doc_id, score in scores.items()
+    }
+    # Only the documents above the threshold are sorted, by a key looked up
+    # in C rather than by a lambda over (doc_id, score) pairs.
+    return sorted((doc_id for doc_id, score in normalized_scores.items()
+                   if score > THRESHOLD),
+                  key=normalized_scores.__getitem__,
+                  reverse=True)
 
 
-def query_to_vector(query: str) -> Counter:
-    return Counter(x for x in query.strip().split(' '))
-
-
-def normalized_vector(query_vector):
-    result = defaultdict(float)
-    for term, value in query_vector.items():
-        result[normalise(term)] += value
-    return result
-
-
-def rocchio_algorithm(query: Dict[str, int], relevant_doc_ids: List[str],
-                      docs_vector: Dict[str, Tuple[int, int]], alpha: int,
-                      beta: int, postings_file: BinaryIO) -> Dict[str, float]:
+def rocchio_algorithm(query: Dict[str, int], relevant_doc_ids: List[int],
+                      docs_vector: Dict[int, Tuple[int, int]], alpha: int,
+                      beta: int, postings_file: mmap) -> Dict[str, float]:
+    prefetch_postings(postings_file, (docs_vector[doc_id]
+                                      for doc_id in relevant_doc_ids
+                                      if doc_id in docs_vector))
     relevant_docs_sum = Counter()
     for doc_id in relevant_doc_ids:
-        relevant_docs_sum += load_document_vector(doc_id, postings_file,
-                                                  docs_vector)
-    relevant_docs_centroid = Counter({
-        doc_id: beta * count / len(relevant_doc_ids)
-        for doc_id, count in relevant_docs_sum.items()
-    })
-
-    normalized_query = Counter({k: alpha * v for k, v in query.items()})
-    return dict(normalized_query + relevant_docs_centroid)
+        # update adds in place, whereas += also rescans the whole sum for
+        # non-positive counts after every document
+        relevant_docs_sum.update(
+            load_document_vector(doc_id, postings_file, docs_vector))
+    # The centroid is scaled and added to the weighted query in one pass,
+    # instead of building a Counter for each and adding them.
+    result = {term: alpha * value for term, value in query.items()}
+    num_relevant_docs = len(relevant_doc_ids)
+    for term, count in relevant_docs_sum.items():
+        result[term] = result.get(term, 0) + beta * count / num_relevant_docs
+    # Like Counter addition, only keep the positive weights
+    return {term: value for term, value in result.items() if value > 0}
 
 
 def query_expansion(query):
@@ -80,15 +85,15 @@ def query_expansion(query):
             continue
         syn_term = synonyms[0]
         for synset in synonyms[1:]:
-            factor = wordnet_score_factor(syn_term, synset)
             try:
                 new_term = normalise(synset.lemmas()[0].name())
-            except:
+            except IndexError:
                 continue
             if new_term in result:
-                # We only find highest scoring synonyms
+                # We only find highest scoring synonyms, checked before the
+                # costly similarity is computed
                 continue
-            result[new_term] = factor * count
+            result[new_term] = wordnet_score_factor(syn_term, synset) * count
     return dict(Counter(result) + Counter(query))
 
 
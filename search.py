@@ -5,12 +5,15 @@ Processes search queries
 import csv
 import getopt
 import sys
+from collections import Counter
+from itertools import chain
+from mmap import mmap, ACCESS_READ
 from typing import Dict, Tuple, List, Union
 
 from data_structures import TokenType, QueryType
 from ranked_retrieval import get_relevant_docs
 from boolean_retrieval import perform_boolean_query
-from search_helpers import normalise, load_dictionaries
+from search_helpers import TOKEN_PATTERN, normalise, load_dictionaries
 
 
 def usage() -> None:
@@ -28,22 +31,25 @@ def usage() -> None:
 
 
 def process_query(
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        vector_lengths: Dict[str, float], postings_file_location: str,
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        vector_lengths: Dict[int, float], postings_file_location: str,
         file_of_queries_location: str,
-        document_vectors_dictionary: Dict[str, Tuple[int, int]],
+        document_vectors_dictionary: Dict[int, Tuple[int, int]],
         file_of_output_location: str) -> None:
     """
     Process the query in the query file.
     """
     with open(file_of_queries_location, 'r') as query_file, \
-            open(postings_file_location, 'rb') as postings_file, \
+            open(postings_file_location, 'rb') as postings, \
+            mmap(postings.fileno(), 0, access=ACCESS_READ) as postings_file, \
             open(file_of_output_location, 'w') as output_file:
         query, *relevant_doc_ids = list(query_file)
         query_type, tokens = parse_query(query)
-        relevant_doc_ids = [x.strip() for x in relevant_doc_ids]
-        query_phrase = " ".join([x for _, x in tokens])
-        result = get_relevant_docs(query_phrase, dictionary, vector_lengths,
+        relevant_doc_ids = [int(x) for x in relevant_doc_ids if x.strip()]
+        query_vector = Counter(
+            chain.from_iterable(x if token_type is TokenType.PHRASE else [x]
+                                for token_type, x in tokens))
+        result = get_relevant_docs(query_vector, dictionary, vector_lengths,
                                    relevant_doc_ids,
                                    document_vectors_dictionary, postings_file)
         if query_type is QueryType.BOOLEAN:
@@ -61,8 +67,7 @@ def process_query(
             relevant_boolean.extend(boolean_results)
             relevant_boolean.extend(relevant_non_boolean)
             result = relevant_boolean
-        postings = str(result)
-        output_file.write(postings + "\n")
+        output_file.write(" ".join(map(str, result)) + "\n")
 
 
 def parse_query(
@@ -89,10 +94,14 @@ def parse_query(
 def parse_token(token: str) -> Tuple[TokenType, Union[List[str], str]]:
     """
     Parses the given token by normalising it.
+    The token is split into words with the same pattern as the documents,
+    so a term such as well-known that the index holds as two words is
+    searched as a phrase of those words.
     """
-    if ' ' in token:
-        return TokenType.PHRASE, [normalise(word) for word in token.split()]
-    return TokenType.NON_PHRASE, normalise(token)
+    words = [normalise(word) for word in TOKEN_PATTERN.findall(token)]
+    if ' ' in token or len(words) != 1:
+        return TokenType.PHRASE, words
+    return TokenType.NON_PHRASE, words[0]
 
 
 # def process_query(query, dictionary, postings_file, output_file):
@@ -1,106 +1,235 @@
 """
-Contains helper methods for search.py
+Contains helper methods for search.py.
+The normalisation and weighting helpers are also used by index.py.
 """
+import mmap as mmap_module
 import pickle
+import re
 
-from typing import Dict, Tuple, BinaryIO
-from math import log
+from array import array
+from mmap import PAGESIZE, mmap
+from typing import Dict, Iterable, List, Tuple
+from math import log10
 from collections import Counter
 from functools import lru_cache
 
+import nltk
 from nltk.stem.porter import PorterStemmer
 
-from data_structures import LinkedList
+from postings_codec import (DOC_ID_TYPECODE, HEADER, decode_doc_ids,
+                            decode_positional_postings,
+                            decode_term_frequencies, get_doc_ids_offset)
+
+# A single stemmer is shared by all calls, as the stemmer holds no state
+# between words.
+STEMMER = PorterStemmer()
+# Stems are kept across runs in a file next to the dictionary file, so that
+# rebuilding the index does not stem the same words again.
+STEM_CACHE_SUFFIX = ".stems"
+# Saved stems are only reused if this stemmer made them, as queries are
+# always stemmed afresh by it.
+STEMMER_VERSION = (nltk.__version__, STEMMER.mode)
+# Not every platform can advise the kernel, prefetching is then skipped
+MADV_WILLNEED = getattr(mmap_module, "MADV_WILLNEED", None)
+# Words are runs of word characters, punctuation is not indexed. Documents
+# and queries must be split with the same pattern.
+TOKEN_PATTERN = re.compile(r"\w+")
 
 #######################
 # Parsing and loading #
 #######################
 
 
-def get_weighted_tf(count: int, base: int = 10) -> float:
+@lru_cache(maxsize=None)
+def get_weighted_tf(count: int) -> float:
     """
     Calculates the weighted term frequency
-    using the 'logarithm' scheme.
+    using the 'logarithm' scheme. Term frequencies are small and repeat
+    often, so weights are cached for performance.
     """
-    return log(base * count, base)
+    return 1 + log10(count)
 
 
-def get_weighted_tfs(counts: Dict[str, int]) -> Dict[str, float]:
+def load_stem_cache(stem_cache_location: str) -> Dict[str, str]:
     """
-    Calculate the weighted term frequencies.
+    Loads the stems saved by a previous run, or an empty cache if there are
+    none or they were made by another version of the stemmer.
     """
-    return {k: get_weighted_tf(v) for k, v in counts.items()}
+    try:
+        with open(stem_cache_location, "rb") as stem_cache_file:
+            stemmer_version, stems = pickle.load(stem_cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError):
+        return {}
+    return stems if stemmer_version == STEMMER_VERSION else {}
+
+
+# Only index.py fills this with load_stem_cache, as a search stems a few
+# query words and does not need the stems of the whole collection.
+STEM_CACHE: Dict[str, str] = {}
+# Stems computed since the last call to take_new_stems
+NEW_STEMS: Dict[str, str] = {}
 
 
-@lru_cache(maxsize=None)
 def normalise(token: str) -> str:
     """
     Returns a normalised token. Normalised tokens are cached for performance
     """
-    token = token.lower()
-    return PorterStemmer().stem(token)
+    stem = STEM_CACHE.get(token)
+    if stem is None:
+        # Case variants of a word share the stem of its lowercase form
+        lowered = token.lower()
+        stem = STEM_CACHE.get(lowered)
+        if stem is None:
+            stem = STEM_CACHE[lowered] = NEW_STEMS[lowered] = STEMMER.stem(
+                lowered)
+        STEM_CACHE[token] = NEW_STEMS[token] = stem
+    return stem
+
+
+def normalise_tokens(tokens: List[str]) -> List[str]:
+    """
+    Returns the normalised tokens. Tokens whose stems are cached are looked
+    up without calling normalise for each of them.
+    """
+    stems = list(map(STEM_CACHE.get, tokens))
+    if None in stems:
+        stems = [
+            normalise(token) if stem is None else stem
+            for token, stem in zip(tokens, stems)
+        ]
+    return stems
+
 
+def take_new_stems() -> Dict[str, str]:
+    """
+    Returns the stems computed by this process since the last call, so that
+    stems computed in worker processes can be merged into STEM_CACHE.
+    """
+    new_stems = NEW_STEMS.copy()
+    NEW_STEMS.clear()
+    return new_stems
+
+
+def save_stem_cache(stem_cache_location: str) -> None:
+    """
+    Saves STEM_CACHE for the next run, with the version of the stemmer that
+    made it.
+    """
+    with open(stem_cache_location, "wb") as stem_cache_file:
+        pickle.dump((STEMMER_VERSION, STEM_CACHE), stem_cache_file,
+                    pickle.HIGHEST_PROTOCOL)
 
-def load_document_vector(doc_id: str, postings_file: BinaryIO,
-                         document_vector_dictionary: Dict[str, Tuple[int, int]]
+
+def load_document_vector(doc_id: int, postings_file: mmap,
+                         document_vector_dictionary: Dict[int, Tuple[int, int]]
                          ) -> Dict[str, int]:
     """
     Loads the document vectors for the given doc_id from the postings file.
 
     Returns a Counter where the key is token and the value is the occurrence.
     """
-    if doc_id not in document_vector_dictionary:
+    entry = document_vector_dictionary.get(doc_id)
+    if entry is None:
         return Counter()
-    offset, length = document_vector_dictionary[doc_id]
-    postings_file.seek(offset)
-    pickled = postings_file.read(length)
-    return pickle.loads(pickled)
+    offset, length = entry
+    return pickle.loads(postings_file[offset:offset + length])
+
+
+def prefetch_postings(postings_file: mmap,
+                      locations: Iterable[Tuple[int, int]]) -> None:
+    """
+    Advises the kernel to read the given (offset, length) ranges of the
+    postings file ahead, so that they are read together instead of one page
+    fault at a time when they are first decoded.
+    """
+    if MADV_WILLNEED is None:
+        return
+    for offset, length in sorted(locations):
+        start = offset - offset % PAGESIZE
+        postings_file.madvise(MADV_WILLNEED, start, offset + length - start)
+
 
+def load_weighted_postings(
+        postings_file: mmap,
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        token: str) -> Tuple[array, List[float]]:
+    """
+    Loads the document ids and the weighted term frequencies of the postings
+    list of token, without building a (doc_id, weight) pair for each.
+    The document ids come from the cache of `read_doc_ids`, shared with
+    boolean retrieval, so the returned array must not be modified.
+
+    Returns empty sequences if token is not in dictionary.
+    """
+    entry = dictionary.get(token)
+    if entry is None:
+        return array(DOC_ID_TYPECODE), []
+    _, offset, length, _, _ = entry
+    doc_ids_offset = get_doc_ids_offset(
+        postings_file[offset:offset + HEADER.size])
+    term_frequencies = decode_term_frequencies(
+        postings_file[offset:offset + doc_ids_offset])
+    return (read_doc_ids(postings_file, offset, length),
+            list(map(get_weighted_tf, term_frequencies)))
+
+
+def load_doc_ids(
+        postings_file: mmap,
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        token: str) -> array:
+    """
+    Loads only the document ids of the postings list from postings file using
+    the location provided by the dictionary.
 
-def load_postings_list(
-        postings_file: BinaryIO,
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        token: str) -> LinkedList[Tuple[str, float]]:
+    Returns an empty array if token is not in dictionary.
     """
-    Loads postings list from postings file using the location provided
-    by the dictionary.
+    entry = dictionary.get(token)
+    if entry is None:
+        return decode_doc_ids(b'')
+    _, offset, length, _, _ = entry
+    return read_doc_ids(postings_file, offset, length)
+
 
-    Returns an empty LinkedList if token is not in dictionary.
+@lru_cache(maxsize=4096)
+def read_doc_ids(postings_file: mmap, offset: int, length: int) -> array:
+    """
+    Reads the document ids of the postings list at the given location.
+    Decoded document ids are cached, so the returned array must not be
+    modified.
     """
-    if token not in dictionary:
-        return LinkedList()
-    _, (offset, length), _ = dictionary[token]
-    postings_file.seek(offset)
-    pickled = postings_file.read(length)
-    return pickle.loads(pickled)
+    doc_ids_offset = offset + get_doc_ids_offset(
+        postings_file[offset:offset + HEADER.size])
+    return decode_doc_ids(postings_file[doc_ids_offset:offset + length])
 
 
 def load_positional_index(
-        postings_file: BinaryIO,
-        dictionary: Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-        token: str) -> LinkedList[Tuple[str, LinkedList[int]]]:
+        postings_file: mmap,
+        dictionary: Dict[str, Tuple[float, int, int, int, int]],
+        token: str) -> List[Tuple[int, List[int]]]:
     """
     Loads positional index from postings file using the location provided
-    by the dictionary.
+    by the dictionary. It is returned as the contiguous list of
+    (doc_id, positions) it is decoded into, as phrase merging only needs to
+    iterate over it.
 
-    Returns an empty LinkedList if token is not in dictionary.
+    Returns an empty list if token is not in dictionary.
     """
-    if token not in dictionary:
-        return LinkedList()
-    _, _, (offset, length) = dictionary[token]
-    postings_file.seek(offset)
-    pickled = postings_file.read(length)
-    return pickle.loads(pickled)
+    entry = dictionary.get(token)
+    if entry is None:
+        return []
+    _, _, _, offset, length = entry
+    return decode_positional_postings(postings_file[offset:offset + length])
 
 
 def load_dictionaries(
         dictionary_file_location: str
-) -> Tuple[Dict[str, Tuple[float, Tuple[int, int], Tuple[int, int]]],
-           Dict[str, Tuple[int, int]], Dict[str, Tuple[int, int]],
-           Dict[str, float]]:
+) -> Tuple[Dict[str, Tuple[float, int, int, int, int]],
+           Dict[int, Tuple[int, int]], Dict[int, float]]:
     """
     Loads dictionary from dictionary file location.
     Returns a tuple of (dictionary, document_vector_dictionary, vector_lengths)
+    Each dictionary entry is (idf, postings offset, postings length,
+    positional postings offset, positional postings length).
     """
     with open(dictionary_file_location, 'rb') as dictionary_file:
         return pickle.load(dictionary_file)